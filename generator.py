@@ -0,0 +1,677 @@
+import streamlit as st
+import pandas as pd
+import os
+import re
+import zipfile
+import tempfile
+import functools
+import bisect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.utils import get_column_letter
+from datetime import datetime
+from openpyxl.drawing.image import Image as XLImage
+from typing import Optional, Dict, List, Tuple, Any, IO
+from io import BytesIO
+# 尝试导入PIL
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+# 预编译的正则
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+_GOODS_ID_RE = re.compile(r'\d+')
+# 子串查找用的分隔符（按顺序拼接的文本中，第一次出现的位置即第一个包含该子串的项）
+_SEARCH_SEP = '\x00'
+def _build_search_text(texts: List[str]) -> Tuple[str, List[int]]:
+    """按顺序拼接文本，返回拼接结果和每项的起始位置"""
+    starts = []
+    pos = 0
+    for text in texts:
+        starts.append(pos)
+        pos += len(text) + 1
+    return _SEARCH_SEP.join(texts), starts
+def _first_containing(joined: str, starts: List[int], texts: List[str], needle: str) -> int:
+    """第一个包含needle的项的序号，没有则返回-1"""
+    if _SEARCH_SEP in needle:
+        return next((i for i, text in enumerate(texts) if needle in text), -1)
+    pos = joined.find(needle)
+    return bisect.bisect_right(starts, pos) - 1 if pos >= 0 else -1
+# ==================== 出货单生成器类 ====================
+class ShippingOrderGenerator:
+    """出货单生成器 - Streamlit版本"""
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+    # 本身已压缩的文件，写入ZIP时不再压缩
+    STORED_EXTENSIONS = ('.xlsx', '.pdf')
+    CHINESE_NUMBERS = ["一", "二", "三", "四", "五", "六", "七", "八", "九", "十",
+                       "十一", "十二", "十三", "十四", "十五", "十六", "十七", "十八", "十九", "二十"]
+    COLUMN_WIDTHS = [12, 20, 10, 10, 15, 8, 10, 15, 12, 25, 20]
+    ROW_HEIGHT = 60
+    IMAGE_COL_WIDTH = 10
+    # 嵌入图片的最大边长(像素)，约为单元格显示尺寸的两倍
+    IMAGE_MAX_PX = 160
+    # 出货单总行数达到此值才使用进程池：串行每行约1毫秒（含图片、条码），
+    # 每个工作进程启动（重新导入app.py并反序列化生成器）约1~1.5秒，4核时约3000行以上才划算
+    PARALLEL_MIN_ROWS = 3000
+    # 文件名中的非法字符替换为下划线
+    _FILENAME_TRANS = str.maketrans({c: '_' for c in '\\/*?:"<>|'})
+    # 共用样式（openpyxl样式对象创建开销大，全类只创建一次）
+    _CENTER = Alignment(horizontal='center', vertical='center')
+    _ALIGNMENTS = (
+        _CENTER,
+        Alignment(horizontal='left', vertical='center', wrap_text=True),
+        Alignment(horizontal='center', vertical='center', wrap_text=True),
+        _CENTER,
+        Alignment(horizontal='center', vertical='center', wrap_text=True),
+        _CENTER,
+        _CENTER,
+        _CENTER,
+        _CENTER,
+        Alignment(horizontal='justify', vertical='center', wrap_text=True),
+        Alignment(horizontal='justify', vertical='center', wrap_text=True),
+    )
+    _THIN_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'),
+                          top=Side(style='thin'), bottom=Side(style='thin'))
+    _HEADER_FILL = PatternFill(start_color="C6E0B4", end_color="C6E0B4", fill_type="solid")
+    _HEADER_FONT = Font(bold=True)
+    _TITLE_FONT = Font(bold=True, size=14)
+    def __init__(self, main_df, sku_id_df, supplier_sku_df, sku_name_df, 
+                 barcode_files_dict=None, image_files_dict=None):
+        """
+        初始化生成器
+        
+        参数:
+            main_df: 主数据表DataFrame
+            sku_id_df: SKU对应货品ID表DataFrame
+            supplier_sku_df: 供应商SKU表DataFrame
+            sku_name_df: SKU名称表DataFrame
+            barcode_files_dict: 条码文件字典 {文件名: 文件内容bytes}
+            image_files_dict: 图片文件字典 {文件名: 文件内容bytes}
+        """
+        self.main_df = main_df
+        self.main_df['原始顺序'] = range(len(self.main_df))
+        self.sku_id_df = sku_id_df
+        self.supplier_sku_df = supplier_sku_df
+        self.sku_name_df = sku_name_df
+        self.barcode_files_dict = barcode_files_dict or {}
+        self.image_files_dict = image_files_dict or {}
+        # 数据缓存
+        self._product_id_index: Dict[str, Tuple] = {}
+        self._supplier_exact: Dict[str, Tuple[str, bool]] = {}
+        self._supplier_ranks: Dict[str, int] = {}
+        self._supplier_prefixes: Dict[str, Tuple[int, Tuple[str, bool]]] = {}
+        self._image_cache: Dict[str, Optional[bytes]] = {}
+        self._image_by_prefix: Dict[str, Optional[str]] = {}
+        self._image_names: List[str] = []
+        self._image_ranks: Dict[str, int] = {}
+        self._image_text = ''
+        self._image_starts: List[int] = []
+        self._name_index: Dict[str, str] = {}
+        self._name_skus: List[str] = []
+        self._name_values: List[str] = []
+        self._name_text = ''
+        self._name_starts: List[int] = []
+        self._barcode_index: Dict[str, Optional[str]] = {}
+        self._init_lookup_caches()
+        # 列索引映射
+        self.col_mapping: Dict[str, int] = {}
+        # 初始化
+        self._identify_columns()
+        self._dedupe_lookup_tables()
+        self._build_product_id_index()
+        self._build_supplier_cache()
+        self._build_image_cache()
+        self._build_name_index()
+        self._build_barcode_index()
+    def _init_lookup_caches(self):
+        """按输入值记忆的查找结果缓存（跨店铺复用）"""
+        self._product_details_cached = functools.lru_cache(maxsize=4096)(self._compute_product_details)
+        self._unit_quantity_cached = functools.lru_cache(maxsize=4096)(self._compute_unit_quantity)
+    def __getstate__(self):
+        # lru_cache包装的方法不能pickle（传给工作进程时），在接收端重建
+        state = self.__dict__.copy()
+        del state['_product_details_cached']
+        del state['_unit_quantity_cached']
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lookup_caches()
+    def _safe_str(self, value: Any) -> str:
+        if pd.isna(value):
+            return ""
+        return str(value).strip()
+    def _safe_int(self, value: Any, default: int = 0) -> int:
+        if pd.isna(value):
+            return default
+        try:
+            return int(float(value))
+        except (ValueError, TypeError):
+            return default
+    def _identify_columns(self):
+        """识别SKU对应货品ID表中的关键列"""
+        column_patterns = {
+            '货品id': ['货品id', '货品Id', '货品ID'],
+            '货品编码': ['货品编码', 'sku', 'SKU'],
+            '单套个数': ['单套个数', '单套数量'],
+            '商品详情': ['商品详情备注', '商品详情', '详情备注']
+        }
+        for col_idx, col_name in enumerate(self.sku_id_df.columns):
+            col_str = str(col_name).strip()
+            col_lower = col_str.lower()
+            for key, patterns in column_patterns.items():
+                if key not in self.col_mapping:
+                    for pattern in patterns:
+                        if pattern.lower() in col_lower or pattern in col_str:
+                            self.col_mapping[key] = col_idx
+                            break
+        self.col_mapping.setdefault('货品id', 1)
+        if '商品详情' not in self.col_mapping and len(self.sku_id_df.columns) > 2:
+            self.col_mapping['商品详情'] = 2
+    def _dedupe_lookup_tables(self):
+        """去除查找表中的重复键（保留与原查找结果一致的行：货品ID取最后一行，名称取第一行）"""
+        # 按查找时使用的字符串判断重复（1012与1012.0哈希相等，但查找键不同）
+        product_id_col = self.col_mapping.get('货品id', 1)
+        if len(self.sku_id_df.columns) > product_id_col:
+            ids = self.sku_id_df.iloc[:, product_id_col]
+            keys = ids.map(self._safe_str)
+            self.sku_id_df = self.sku_id_df[ids.isna() | ~keys.duplicated(keep='last')]
+        if len(self.sku_name_df.columns) >= 1:
+            keys = self.sku_name_df.iloc[:, 0].map(self._safe_str)
+            self.sku_name_df = self.sku_name_df[~keys.duplicated(keep='first')]
+    def _build_product_id_index(self):
+        """建立货品ID索引（值为整行数据的元组）"""
+        product_id_col = self.col_mapping.get('货品id', 1)
+        if len(self.sku_id_df.columns) <= product_id_col:
+            return
+        for row in self.sku_id_df.itertuples(index=False, name=None):
+            if pd.notna(row[product_id_col]):
+                product_id = self._safe_str(row[product_id_col])
+                try:
+                    normalized_id = str(int(float(product_id)))
+                    self._product_id_index[normalized_id] = row
+                except (ValueError, TypeError):
+                    pass
+                self._product_id_index[product_id] = row
+    def _build_supplier_cache(self):
+        """建立供应商SKU缓存（精确匹配表 + 前缀表）"""
+        current_supplier = "其他供应商"
+        for row in self.supplier_sku_df.itertuples(index=False, name=None):
+            for cell in row:
+                if pd.notna(cell):
+                    cell_str = str(cell).strip()
+                    if _CJK_RE.search(cell_str) or '供应商' in cell_str or '厂' in cell_str:
+                        current_supplier = cell_str
+                    else:
+                        self._supplier_exact[cell_str] = (current_supplier, True)
+        # 登记顺序，两个方向都能匹配时取先登记的SKU
+        for rank, (cached_sku, result) in enumerate(self._supplier_exact.items()):
+            self._supplier_ranks[cached_sku] = rank
+            # 已登记SKU的所有真前缀，记录最先登记的SKU
+            for end in range(1, len(cached_sku)):
+                self._supplier_prefixes.setdefault(cached_sku[:end], (rank, result))
+    def _build_image_cache(self):
+        """建立图片缓存（每张图片在此处理一次，插入时直接使用处理后的数据）"""
+        for filename, content in self.image_files_dict.items():
+            name_without_ext = os.path.splitext(filename)[0].lower()
+            processed = self._process_image_data(content)
+            self._image_cache[name_without_ext] = processed.getvalue() if processed else content
+        # 完整文件名直接命中；其余按上传顺序取第一个与前缀互相包含的文件名
+        for name in self._image_cache:
+            self._image_by_prefix[name] = name
+        self._image_names = list(self._image_cache)
+        self._image_ranks = {name: rank for rank, name in enumerate(self._image_names)}
+        self._image_text, self._image_starts = _build_search_text(self._image_names)
+    def _build_name_index(self):
+        """建立SKU名称查找表（按名称表的行顺序拼接SKU，查找时取第一个包含前缀的行）"""
+        if len(self.sku_name_df.columns) < 2:
+            return
+        for row in self.sku_name_df.itertuples(index=False, name=None):
+            if pd.notna(row[0]):
+                self._name_skus.append(str(row[0]))
+                self._name_values.append(self._safe_str(row[1]))
+        self._name_text, self._name_starts = _build_search_text(self._name_skus)
+    def _build_barcode_index(self):
+        """建立条码索引：文件名中的每段数字（货品id）对应该文件，先出现的文件优先"""
+        for filename in self.barcode_files_dict:
+            for goods_id in _GOODS_ID_RE.findall(filename):
+                self._barcode_index.setdefault(goods_id, filename)
+    def _get_row_by_product_id(self, product_id: Any) -> Optional[Tuple]:
+        product_id_str = self._safe_str(product_id)
+        if not product_id_str:
+            return None
+        if product_id_str in self._product_id_index:
+            return self._product_id_index[product_id_str]
+        try:
+            normalized_id = str(int(float(product_id_str)))
+            return self._product_id_index.get(normalized_id)
+        except (ValueError, TypeError):
+            return None
+    def _extract_sku_prefix(self, sku: Any) -> str:
+        sku_str = self._safe_str(sku)
+        return sku_str.split('-')[0] if '-' in sku_str else sku_str
+    def _get_multiplier_from_sku(self, sku: str) -> Optional[int]:
+        # 匹配结尾的 -<数字>X，逐单调用，不使用正则
+        _, sep, tail = sku.rpartition('-')
+        if sep and len(tail) > 1 and tail[-1] in 'Xx' and tail[:-1].isdecimal():
+            return int(tail[:-1])
+        return None
+    def _get_unit_quantity(self, sku: Any, product_id: Any) -> int:
+        """每套个数：优先取单套个数列，其次取SKU中的倍数，默认为1"""
+        return self._unit_quantity_cached(self._safe_str(sku), self._safe_str(product_id))
+    def _compute_unit_quantity(self, sku_str: str, product_id_str: str) -> int:
+        if product_id_str and '单套个数' in self.col_mapping:
+            row = self._get_row_by_product_id(product_id_str)
+            if row is not None:
+                unit_qty = self._safe_int(row[self.col_mapping['单套个数']])
+                if unit_qty > 0:
+                    return unit_qty
+        if not sku_str and product_id_str and '货品编码' in self.col_mapping:
+            row = self._get_row_by_product_id(product_id_str)
+            if row is not None:
+                sku_str = self._safe_str(row[self.col_mapping['货品编码']])
+        if sku_str:
+            multiplier = self._get_multiplier_from_sku(sku_str)
+            if multiplier:
+                return multiplier
+        return 1
+    def calculate_total_quantity(self, sku: Any, sets: Any, product_id: Any) -> int:
+        sets_int = self._safe_int(sets)
+        if sets_int <= 0:
+            return 0
+        return sets_int * self._get_unit_quantity(sku, product_id)
+    def get_product_name(self, sku_prefix: str) -> str:
+        """第一个SKU包含该前缀的行的商品名称，结果按前缀记忆"""
+        if not sku_prefix:
+            return ""
+        name = self._name_index.get(sku_prefix)
+        if name is None:
+            idx = _first_containing(self._name_text, self._name_starts, self._name_skus, sku_prefix)
+            name = (self._name_values[idx] or sku_prefix) if idx >= 0 else sku_prefix
+            self._name_index[sku_prefix] = name
+        return name
+    def get_product_details(self, product_id: Any) -> str:
+        return self._product_details_cached(self._safe_str(product_id))
+    def _compute_product_details(self, product_id_str: str) -> str:
+        if '商品详情' not in self.col_mapping:
+            return ""
+        row = self._get_row_by_product_id(product_id_str)
+        if row is not None:
+            return self._safe_str(row[self.col_mapping['商品详情']])
+        return ""
+    def get_supplier_group(self, sku_prefix: str) -> Tuple[str, bool]:
+        if not sku_prefix:
+            return "其他供应商", False
+        result = self._supplier_exact.get(sku_prefix)
+        if result is not None:
+            return result
+        # 已登记SKU以该前缀开头
+        best = self._supplier_prefixes.get(sku_prefix)
+        # 该前缀以已登记SKU开头，与上面的结果比较登记顺序
+        for end in range(1, len(sku_prefix)):
+            rank = self._supplier_ranks.get(sku_prefix[:end])
+            if rank is not None and (best is None or rank < best[0]):
+                best = (rank, self._supplier_exact[sku_prefix[:end]])
+        if best is not None:
+            return best[1]
+        return "其他供应商", False
+    def find_image_key(self, sku_prefix: str) -> Optional[str]:
+        """查找图片在缓存中的键"""
+        if not sku_prefix:
+            return None
+        sku_lower = sku_prefix.lower()
+        # 索引匹配
+        if sku_lower in self._image_by_prefix:
+            return self._image_by_prefix[sku_lower]
+        # 模糊匹配：包含该前缀的第一个文件名，与该前缀中包含的文件名比较上传顺序
+        rank = _first_containing(self._image_text, self._image_starts, self._image_names, sku_lower)
+        for start in range(len(sku_lower)):
+            for end in range(start + 1, len(sku_lower) + 1):
+                sub_rank = self._image_ranks.get(sku_lower[start:end])
+                if sub_rank is not None and (rank < 0 or sub_rank < rank):
+                    rank = sub_rank
+        # 结果（包括未找到）记入索引
+        key = self._image_names[rank] if rank >= 0 else None
+        self._image_by_prefix[sku_lower] = key
+        return key
+    def find_image_data(self, sku_prefix: str) -> Optional[bytes]:
+        """查找图片数据"""
+        key = self.find_image_key(sku_prefix)
+        return self._image_cache[key] if key is not None else None
+    def find_barcode_data(self, product_id: Any) -> Tuple[Optional[bytes], Optional[str]]:
+        """查找条码数据"""
+        product_id_str = self._safe_str(product_id)
+        if not product_id_str:
+            return None, None
+        if product_id_str in self._barcode_index:
+            filename = self._barcode_index[product_id_str]
+        else:
+            # 按包含关系查找，结果（包括未找到）记入索引
+            filename = next((name for name in self.barcode_files_dict if product_id_str in name), None)
+            self._barcode_index[product_id_str] = filename
+        if filename is None:
+            return None, None
+        return self.barcode_files_dict[filename], filename
+    def _process_image_data(self, image_data: bytes) -> Optional[BytesIO]:
+        """处理图片数据"""
+        if not image_data:
+            return None
+        try:
+            if not PIL_AVAILABLE:
+                return BytesIO(image_data)
+            img = PILImage.open(BytesIO(image_data))
+            # 尺寸不超限的RGB JPEG可直接使用，无需解码后重新编码
+            fits = max(img.size) <= self.IMAGE_MAX_PX
+            if fits and image_data[:3] == b'\xff\xd8\xff' and img.mode == 'RGB':
+                return BytesIO(image_data)
+            if img.mode in ('RGBA', 'LA', 'P'):
+                if img.mode == 'P':
+                    img = img.convert('RGBA')
+                background = PILImage.new('RGB', img.size, (255, 255, 255))
+                if img.mode == 'RGBA':
+                    background.paste(img, mask=img.split()[-1])
+                    img = background
+                else:
+                    img = img.convert('RGB')
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            # 转为RGB后再缩小（调色板图片直接缩小只能用最近邻采样），避免每行都嵌入原图
+            if not fits:
+                img.thumbnail((self.IMAGE_MAX_PX, self.IMAGE_MAX_PX))
+            buffer = BytesIO()
+            img.save(buffer, format='JPEG', quality=95)
+            buffer.seek(0)
+            return buffer
+        except Exception:
+            return BytesIO(image_data)
+    def _insert_image(self, ws, row: int, col: int, image_key: str) -> bool:
+        """插入图片到Excel"""
+        image_data = self._image_cache.get(image_key)
+        if not image_data:
+            return False
+        try:
+            img = XLImage(BytesIO(image_data))
+            cell_width_px = self.IMAGE_COL_WIDTH * 7
+            cell_height_px = self.ROW_HEIGHT * 1.33
+            scale = min((cell_width_px * 0.85) / img.width, (cell_height_px * 0.85) / img.height)
+            img.width = int(img.width * scale)
+            img.height = int(img.height * scale)
+            x_offset = (cell_width_px - img.width) / 2 + 1 + (0.1 / 2.54 * 96)
+            y_offset = (cell_height_px - img.height) / 2 + 1 + (0.1 / 2.54 * 96)
+            img.anchor = f"{get_column_letter(col)}{row}"
+            img.left = int(x_offset * 9525)
+            img.top = int(y_offset * 9525)
+            ws.add_image(img)
+            return True
+        except Exception:
+            return False
+    def _get_column(self, df: pd.DataFrame, col: Optional[str], default: Any) -> pd.Series:
+        """取出一列数据，列不存在时返回以默认值填充的列"""
+        if col:
+            return df[col]
+        return pd.Series([default] * len(df), index=df.index, dtype=object)
+    def process_order_data(self, store_data: pd.DataFrame) -> Tuple[Dict[str, List], List]:
+        """处理店铺数据"""
+        supplier_orders: Dict[str, List] = {}
+        abnormal_orders: List = []
+        col_names = {
+            'product_id': next((c for c in ['货品Id', '货品id', '货品ID'] if c in store_data.columns), None),
+            'sku': next((c for c in ['货品编码', 'SKU', 'sku'] if c in store_data.columns), None),
+            'sets': next((c for c in ['发货数量', '套数'] if c in store_data.columns), None),
+            'address': '仓库地址' if '仓库地址' in store_data.columns else None,
+            'warehouse': '仓库名称' if '仓库名称' in store_data.columns else None
+        }
+        store_data = store_data.sort_values('原始顺序')
+        product_ids = self._get_column(store_data, col_names['product_id'], '')
+        skus = self._get_column(store_data, col_names['sku'], '')
+        sets = self._get_column(store_data, col_names['sets'], 0)
+        # SKU前缀、货品id先编码为整数，查找结果按唯一值计算一次，逐行按编码取用
+        sku_prefixes = skus.map(self._extract_sku_prefix)
+        prefix_codes, unique_prefixes = pd.factorize(sku_prefixes)
+        suppliers = [self.get_supplier_group(p) for p in unique_prefixes]
+        names = [self.get_product_name(p) for p in unique_prefixes]
+        image_keys = [self.find_image_key(p) for p in unique_prefixes]
+        product_id_strs = product_ids.map(self._safe_str)
+        id_codes, unique_ids = pd.factorize(product_id_strs)
+        details = [self.get_product_details(p) for p in unique_ids]
+        barcode_names = []
+        for p in unique_ids:
+            barcode_data, barcode_name = self.find_barcode_data(p)
+            barcode_names.append(barcode_name if barcode_data else None)
+        # 总数量 = 套数 × 每套个数，每套个数按(SKU, 货品id)组合只计算一次
+        sets_int = sets.map(self._safe_int).astype('int64')
+        unit_keys = pd.MultiIndex.from_arrays([skus.map(self._safe_str), product_id_strs])
+        unique_keys = unit_keys.unique()
+        units = pd.Series([self._get_unit_quantity(k_sku, k_pid) for k_sku, k_pid in unique_keys],
+                          index=unique_keys, dtype='int64')
+        totals = (sets_int * units.reindex(unit_keys).to_numpy()).where(sets_int > 0, 0)
+        # 缺失的仓库名称统一为None（NaN经pickle传给工作进程后各不相等，会被拆成不同的仓库）
+        warehouses = [None if pd.isna(w) else w
+                      for w in self._get_column(store_data, col_names['warehouse'], '').tolist()]
+        rows = zip(
+            product_ids.tolist(), id_codes.tolist(), skus.tolist(), sku_prefixes.tolist(), prefix_codes.tolist(),
+            sets_int.tolist(), totals.tolist(),
+            self._get_column(store_data, col_names['address'], '').tolist(),
+            warehouses,
+            store_data['原始顺序'].tolist()
+        )
+        for (product_id, id_code, sku, sku_prefix, prefix_code, sets_value, total,
+             address, warehouse, order_idx) in rows:
+            supplier, found = suppliers[prefix_code]
+            order_data = {
+                'SKU': sku,
+                '商品名称': names[prefix_code],
+                '商品图片key': image_keys[prefix_code],
+                'SKU前缀': sku_prefix,
+                '商品详情': details[id_code],
+                '套数': sets_value,
+                '总数量': total,
+                '货品id': product_id,
+                '仓库地址': address,
+                '仓库名称': warehouse,
+                '原始顺序': order_idx,
+                'barcode_filename': barcode_names[id_code]
+            }
+            if found:
+                supplier_orders.setdefault(supplier, []).append(order_data)
+            else:
+                abnormal_orders.append(order_data)
+        return supplier_orders, abnormal_orders
+    def merge_orders(self, orders: List[Dict]) -> List[Dict]:
+        """合并相同仓库和货品ID的订单（直接累加到每组第一条订单上，orders需按原始顺序排列）"""
+        merged: Dict[Tuple[Any, Any], Dict] = {}
+        for order in orders:
+            warehouse, product_id = order['仓库名称'], order['货品id']
+            # 缺失值统一为None，保证仍能合并
+            key = (None if pd.isna(warehouse) else warehouse, None if pd.isna(product_id) else product_id)
+            first = merged.get(key)
+            if first is None:
+                merged[key] = order
+            else:
+                first['套数'] += order['套数']
+                first['总数量'] += order['总数量']
+        return sorted(merged.values(), key=lambda x: x['原始顺序'])
+    def group_by_warehouse(self, orders: List[Dict]) -> List[Dict]:
+        """按仓库分组订单"""
+        groups: Dict[str, Dict] = {}
+        for order in orders:
+            warehouse = order['仓库名称']
+            if warehouse not in groups:
+                groups[warehouse] = {
+                    'warehouse_name': warehouse,
+                    'warehouse_address': order['仓库地址'],
+                    'orders': [],
+                    'min_order': order['原始顺序']
+                }
+            groups[warehouse]['orders'].append(order)
+            groups[warehouse]['min_order'] = min(groups[warehouse]['min_order'], order['原始顺序'])
+        return sorted(groups.values(), key=lambda x: x['min_order'])
+    def create_excel(self, supplier: str, orders: List[Dict], is_abnormal: bool = False) -> Tuple[BytesIO, List[Tuple[str, bytes]]]:
+        """创建Excel出货单，返回Excel数据和条码文件列表"""
+        warehouse_groups = self.group_by_warehouse(orders)
+        barcode_files = []  # [(filename, data), ...]
+        # 只写模式：逐行追加，不在内存中保留完整的单元格对象
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=("异常订单" if is_abnormal else supplier)[:31])
+        # 列宽必须在写入第一行之前设置
+        for i, width in enumerate(self.COLUMN_WIDTHS, 1):
+            ws.column_dimensions[get_column_letter(i)].width = width
+        # 标题
+        title = WriteOnlyCell(ws, value=f"{'异常订单' if is_abnormal else supplier} 出货单 - {datetime.now().strftime('%Y-%m-%d')}")
+        title.font = self._TITLE_FONT
+        title.alignment = self._CENTER
+        ws.append([title])
+        ws.merged_cells.add('A1:K1')
+        ws.append([])
+        # 表头
+        headers = ['单号', 'SKU', '商品名称', '商品图片', '商品详情', '套数', '总数量', '货品id', '条码文件',
+                   '仓库地址', '仓库名称']
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = self._HEADER_FONT
+            cell.fill = self._HEADER_FILL
+            cell.alignment = self._CENTER
+            cell.border = self._THIN_BORDER
+            header_cells.append(cell)
+        ws.append(header_cells)
+        # 填充数据
+        current_row = 4
+        for wh_idx, wh_info in enumerate(warehouse_groups):
+            start_row = current_row
+            order_num = f"第{self.CHINESE_NUMBERS[wh_idx]}单" if wh_idx < len(
+                self.CHINESE_NUMBERS) else f"第{wh_idx + 1}单"
+            for i, order in enumerate(wh_info['orders']):
+                # 条码文件名
+                if order['barcode_filename']:
+                    barcode_name = f"{order['套数']}--{order['barcode_filename']}"
+                    barcode_files.append((barcode_name, self.barcode_files_dict[order['barcode_filename']]))
+                else:
+                    barcode_name = "无条码"
+                values = [
+                    order_num if i == 0 else None,
+                    order['SKU'],
+                    order['商品名称'],
+                    None,
+                    order['商品详情'],
+                    order['套数'],
+                    order['总数量'],
+                    order['货品id'],
+                    barcode_name,
+                    wh_info['warehouse_address'] if i == 0 else None,
+                    wh_info['warehouse_name'] if i == 0 else None,
+                ]
+                row_cells = []
+                for value, align in zip(values, self._ALIGNMENTS):
+                    cell = WriteOnlyCell(ws, value=value)
+                    cell.alignment = align
+                    cell.border = self._THIN_BORDER
+                    row_cells.append(cell)
+                if isinstance(order['货品id'], (int, float)):
+                    row_cells[7].number_format = '0'
+                ws.row_dimensions[current_row].height = self.ROW_HEIGHT
+                ws.append(row_cells)
+                # 插入图片
+                if self._image_cache.get(order['商品图片key']):
+                    self._insert_image(ws, current_row, 4, order['商品图片key'])
+                current_row += 1
+            end_row = current_row - 1
+            if end_row > start_row:
+                ws.merged_cells.add(f"A{start_row}:A{end_row}")
+                ws.merged_cells.add(f"J{start_row}:J{end_row}")
+                ws.merged_cells.add(f"K{start_row}:K{end_row}")
+        # 保存到内存
+        output = BytesIO()
+        wb.save(output)
+        output.seek(0)
+        return output, barcode_files
+    def _add_barcode_files(self, files: List[Tuple[str, bytes]], folder: str,
+                           barcode_files: List[Tuple[str, bytes]]):
+        """加入条码文件（同名文件内容相同，只加入一次）"""
+        written = set()
+        for filename, data in barcode_files:
+            if filename not in written:
+                files.append((f"{folder}/{filename}", data))
+                written.add(filename)
+    def _store_sheet_tasks(self, store_name: Any, store_data: pd.DataFrame) -> List[Tuple[str, str, List[Dict], bool]]:
+        """拆分单个店铺的出货单任务，返回 [(ZIP内文件夹, 供应商, 合并后的订单, 是否异常订单), ...]"""
+        tasks = []
+        safe_name = str(store_name).translate(self._FILENAME_TRANS)
+        store_folder = f"店铺_{safe_name}"
+        supplier_orders, abnormal_orders = self.process_order_data(store_data)
+        # 正常订单
+        for supplier, orders in supplier_orders.items():
+            if not orders:
+                continue
+            safe_supplier = str(supplier).translate(self._FILENAME_TRANS)
+            tasks.append((f"{store_folder}/供应商_{safe_supplier}", supplier, self.merge_orders(orders), False))
+        # 异常订单
+        if abnormal_orders:
+            tasks.append((f"{store_folder}/异常订单", "异常订单", self.merge_orders(abnormal_orders), True))
+        return tasks
+    def build_sheet_files(self, folder: str, supplier: str, orders: List[Dict],
+                          is_abnormal: bool = False) -> List[Tuple[str, bytes]]:
+        """生成一份出货单及其条码文件，返回 [(ZIP内路径, 文件内容), ...]"""
+        excel_data, barcode_files = self.create_excel(supplier, orders, is_abnormal)
+        files = [(f"{folder}/{supplier}_出货单.xlsx", excel_data.getvalue())]
+        self._add_barcode_files(files, f"{folder}/条码", barcode_files)
+        return files
+    def _iter_sheet_files(self, tasks: List[Tuple[str, str, List[Dict], bool]]):
+        """按任务顺序逐个返回生成的文件；多核且数据量足够大时用进程池并行生成"""
+        max_workers = min(len(tasks), os.cpu_count() or 1)
+        total_rows = sum(len(orders) for _, _, orders, _ in tasks)
+        if max_workers <= 1 or total_rows < self.PARALLEL_MIN_ROWS:
+            for task in tasks:
+                yield self.build_sheet_files(*task)
+            return
+        # 用spawn启动工作进程，不fork多线程的Streamlit服务进程
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(self,)) as executor:
+            yield from executor.map(_build_sheet_artifacts, *zip(*tasks))
+    def generate_all_orders(self, progress_callback=None) -> Optional[IO[bytes]]:
+        """生成所有出货单，返回已定位到开头的ZIP临时文件（关闭后自动删除）"""
+        # 确定店铺列
+        store_col = next((c for c in ['店铺名称', '店铺', '店铺名', '店名'] if c in self.main_df.columns), None)
+        if not store_col:
+            st.error(f"❌ 未找到店铺列。可用列: {list(self.main_df.columns)}")
+            return None
+        output_folder = f'出货单_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        # 先拆分出每个店铺×供应商的出货单，再逐份（多核时并行）生成
+        store_names = []
+        tasks = []
+        for store_name, store_data in self.main_df.groupby(store_col, observed=True):
+            for task in self._store_sheet_tasks(store_name, store_data):
+                store_names.append(store_name)
+                tasks.append(task)
+        total_tasks = len(tasks)
+        # ZIP边生成边写入临时文件，只降低生成过程中的内存峰值
+        # （build_shipping_zip仍会读回为bytes并由st.cache_data缓存，最终结果占用的内存不变）
+        zip_buffer = tempfile.TemporaryFile(suffix='.zip')
+        try:
+            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+                for task_idx, (store_name, files) in enumerate(zip(store_names, self._iter_sheet_files(tasks))):
+                    if progress_callback:
+                        progress_callback((task_idx + 1) / total_tasks, f"处理店铺: {store_name}")
+                    for arc_name, data in files:
+                        stored = arc_name.lower().endswith(self.STORED_EXTENSIONS)
+                        zip_file.writestr(f"{output_folder}/{arc_name}", data,
+                                          compress_type=zipfile.ZIP_STORED if stored else None)
+        except BaseException:
+            # 出错（包括Streamlit重新运行时抛出的异常）时关闭并删除临时文件
+            zip_buffer.close()
+            raise
+        zip_buffer.seek(0)
+        return zip_buffer
+# ==================== 多进程生成 ====================
+_worker_generator: Optional[ShippingOrderGenerator] = None
+def _init_worker(generator: ShippingOrderGenerator):
+    """工作进程初始化：保存生成器，各出货单任务共用"""
+    global _worker_generator
+    _worker_generator = generator
+def _build_sheet_artifacts(folder: str, supplier: str, orders: List[Dict],
+                           is_abnormal: bool) -> List[Tuple[str, bytes]]:
+    """工作进程中生成一份出货单及其条码文件"""
+    return _worker_generator.build_sheet_files(folder, supplier, orders, is_abnormal)
\ No newline at end of file